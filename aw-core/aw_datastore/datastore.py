@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime, timedelta, timezone
 from typing import (
     Callable,
@@ -34,7 +35,7 @@ class Datastore:
         # If this bucket doesn't have a initialized object, create it
         if bucket_hash_key not in self.bucket_instances:
             # If the bucket exists in the database, create an object representation of it
-            if bucket_hash_key in self.buckets():
+            if self.bucket_exists(bucket_hash_key):
                 bucket = Bucket(self, bucket_hash_key)
                 self.bucket_instances[bucket_hash_key] = bucket
             else:
@@ -76,6 +77,9 @@ class Datastore:
     def buckets(self):
         return self.storage_strategy.buckets()
 
+    def bucket_exists(self, bucket_hash_key: str) -> bool:
+        return self.storage_strategy.bucket_exists(bucket_hash_key)
+
     def get_user_by_uuid(self, uuid):
         return self.storage_strategy.get_user_by_uuid(uuid)
 
@@ -91,6 +95,10 @@ class Datastore:
         return self.storage_strategy.get_buckets_for_user(user)
 
 class Bucket:
+    # Warning about events reaching into the future costs a datetime addition per inserted event,
+    # so it's opt-in (set AW_CHECK_FUTURE=1 to enable)
+    check_future = os.environ.get("AW_CHECK_FUTURE", "0").lower() in ("1", "true")
+
     def __init__(self, datastore: Datastore, bucket_hash_key: str) -> None:
         self.logger = logger.getChild("Bucket")
         self.ds = datastore
@@ -107,21 +115,15 @@ class Bucket:
     ) -> List[Event]:
         """Returns events sorted in descending order by timestamp"""
         # Resolution is rounded down since not all datastores like microsecond precision
+        # Adjusting with a timedelta is cheaper than replace() and handles overflow into the next second
         if starttime:
-            starttime = starttime.replace(
-                microsecond=1000 * int(starttime.microsecond / 1000)
-            )
+            submillis = starttime.microsecond % 1000
+            if submillis:  # usually already on a millisecond
+                starttime -= timedelta(microseconds=submillis)
         if endtime:
             # Rounding up here in order to ensure events aren't missed
-            # second_offset and microseconds modulo required since replace() only takes microseconds up to 999999 (doesn't handle overflow)
-            milliseconds = 1 + int(endtime.microsecond / 1000)
-            second_offset = int(milliseconds / 1000)  # usually 0, rarely 1
-            microseconds = (
-                (1000 * milliseconds) % 1000000
-            )  # will likely just be 1000 * milliseconds, if it overflows it would become zero
-            endtime = endtime.replace(microsecond=microseconds) + timedelta(
-                seconds=second_offset
-            )
+            # (always to the next millisecond, even if already on a millisecond)
+            endtime += timedelta(microseconds=1000 - endtime.microsecond % 1000)
 
         return self.ds.storage_strategy.get_events(
             self.bucket_hash_key, limit, starttime, endtime
@@ -142,7 +144,7 @@ class Bucket:
         """
         Inserts one or several events.
         If a single event is inserted, return the event with its id assigned.
-        If several events are inserted, returns None. (This is due to there being no efficient way of getting ids out when doing bulk inserts with some datastores such as peewee/SQLite)
+        If several events are inserted, returns None. (Ids are only assigned by storages that support it, peewee/SQLite sets them on the inserted events)
         """
 
         # NOTE: Should we keep the timestamp checking?
@@ -162,22 +164,20 @@ class Bucket:
         # Call insert
         if isinstance(events, Event):
             oldest_event: Optional[Event] = events
-            if events.timestamp + events.duration > now:
+            if self.check_future and events.timestamp + events.duration > now:
                 self.logger.warning(
                     f"Event inserted into bucket {self.bucket_hash_key} reaches into the future. Current UTC time: {str(now)}. Event data: {str(events)}"
                 )
             inserted = self.ds.storage_strategy.insert_one(self.bucket_hash_key, events)
             # assert inserted
         elif isinstance(events, list):
-            if events:
-                oldest_event = sorted(events, key=lambda k: k["timestamp"])[0]
-            else:  # pragma: no cover
-                oldest_event = None
-            for event in events:
-                if event.timestamp + event.duration > now:
-                    self.logger.warning(
-                        f"Event inserted into bucket {self.bucket_hash_key} reaches into the future. Current UTC time: {str(now)}. Event data: {str(event)}"
-                    )
+            oldest_event = min(events, key=lambda e: e.timestamp) if events else None
+            if self.check_future:
+                for event in events:
+                    if event.timestamp + event.duration > now:
+                        self.logger.warning(
+                            f"Event inserted into bucket {self.bucket_hash_key} reaches into the future. Current UTC time: {str(now)}. Event data: {str(event)}"
+                        )
             self.ds.storage_strategy.insert_many(self.bucket_hash_key, events)
         else:
             raise TypeError
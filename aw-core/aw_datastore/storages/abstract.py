@@ -21,6 +21,9 @@ class AbstractStorage(metaclass=ABCMeta):
     def buckets(self) -> Dict[str, dict]:
         raise NotImplementedError
 
+    def bucket_exists(self, bucket_hash_key: str) -> bool:
+        return bucket_hash_key in self.buckets()
+
     @abstractmethod
     def create_bucket(
         self,
@@ -84,9 +87,10 @@ class AbstractStorage(metaclass=ABCMeta):
     def insert_one(self, bucket_hash_key: str, event: Event) -> Event:
         raise NotImplementedError
 
-    def insert_many(self, bucket_hash_key: str, events: List[Event]) -> None:
-        for event in events:
-            self.insert_one(bucket_hash_key, event)
+    def insert_many(
+        self, bucket_hash_key: str, events: List[Event]
+    ) -> Optional[List[Event]]:
+        return [self.insert_one(bucket_hash_key, event) for event in events]
 
     @abstractmethod
     def delete(self, bucket_hash_key: str, event_id: int) -> bool:
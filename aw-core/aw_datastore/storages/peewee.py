@@ -1,27 +1,30 @@
 import hashlib
 import json
 import logging
+import math
 import os
 from datetime import datetime, timedelta, timezone
+from threading import Lock
 from typing import (
     Any,
     Dict,
     List,
     Optional,
+    Tuple,
 )
 
 import iso8601
 from aw_core.dirs import get_data_dir
 from aw_core.models import Event
 from playhouse.migrate import SqliteMigrator, migrate
-from playhouse.sqlite_ext import SqliteExtDatabase, JSONField
+from playhouse.sqlite_ext import CYTHON_SQLITE_EXTENSIONS, SqliteExtDatabase, JSONField
 
 import peewee
 from peewee import (
     AutoField,
     CharField,
     DateTimeField,
-    DecimalField,
+    FloatField,
     ForeignKeyField,
     IntegerField,
     Model,
@@ -29,52 +32,172 @@ from peewee import (
 
 from .abstract import AbstractStorage
 
+# orjson is optional (install with the `speedups` extra), it's a lot faster than
+# the stdlib json module at encoding/decoding the datastr of every event.
+# Whatever orjson can't encode goes through json.dumps, which handles integers beyond 64 bits and raises
+# TypeError for the rest (datetimes, dataclasses, sets, ...) like before. orjson encodes NaN/Infinity as null,
+# so data containing them is encoded with json.dumps too (only checked for when the output contains a null).
+# Still different: UUIDs, enums and non-str keys like dates are encoded instead of raising TypeError.
+# NaN/Infinity written by json.dumps aren't valid JSON to orjson, so those are read with json.loads.
+try:
+    import orjson
+
+    _ORJSON_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def _has_non_finite_float(obj: Any) -> bool:
+        if isinstance(obj, float):
+            return not math.isfinite(obj)
+        if isinstance(obj, dict):
+            return any(_has_non_finite_float(k) or _has_non_finite_float(v) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return any(_has_non_finite_float(v) for v in obj)
+        return False
+
+    def json_dumps(obj: Any) -> str:
+        try:
+            encoded = orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return json.dumps(obj)
+        if b"null" in encoded and _has_non_finite_float(obj):
+            return json.dumps(obj)
+        return encoded.decode()
+
+    def json_loads(s: str) -> Any:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return json.loads(s)
+
+    ORJSON = True
+except ImportError:  # pragma: no cover
+    ORJSON = False
+
+    def json_dumps(obj: Any) -> str:
+        return json.dumps(obj)
+
+    def json_loads(s: str) -> Any:
+        return json.loads(s)
+
 logger = logging.getLogger(__name__)
 
 # Prevent debug output from propagating
 peewee_logger = logging.getLogger("peewee")
 peewee_logger.setLevel(logging.INFO)
 
-# Init'd later in the PeeweeStorage constructor.
-#   See: http://docs.peewee-orm.com/en/latest/peewee/database.html#run-time-database-configuration
-# Another option would be to use peewee's Proxy.
+# Bound to the actual database in the PeeweeStorage constructor.
 #   See: http://docs.peewee-orm.com/en/latest/peewee/database.html#dynamic-db
-_db = SqliteExtDatabase(None)
+_db = peewee.DatabaseProxy()
+
+# Applied by peewee on every connect().
+# WAL with synchronous=normal avoids an fsync on every commit while staying safe against corruption.
+#   See: https://www.sqlite.org/pragma.html and https://www.sqlite.org/wal.html
+PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64000,  # in KiB, so ~64MB
+    "mmap_size": 268435456,  # 256MB
+    "temp_store": "memory",
+}
 
 
 LATEST_VERSION = 2
 
+# Rough size in bytes of an event row besides its datastr (timestamps, duration, ids and SQLite's record header),
+# used to estimate the size of buckets
+EVENT_ROW_OVERHEAD = 80
+
+# Plain SQL for the hot single-event paths, saves building and rendering peewee queries on every call
+INSERT_EVENT = """
+    INSERT INTO eventmodel (bucket_id, timestamp, duration, endtime, datastr)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+GET_EVENT = """
+    SELECT id, timestamp, duration, datastr FROM eventmodel
+    WHERE id = ? AND bucket_id = ?
+"""
+
+GET_LAST_EVENT = """
+    SELECT id, timestamp, duration, datastr FROM eventmodel
+    WHERE bucket_id = ? ORDER BY timestamp DESC LIMIT 1
+"""
+
+UPDATE_EVENT = """
+    UPDATE eventmodel SET timestamp = ?, duration = ?, endtime = ?, datastr = ?
+    WHERE id = ? AND bucket_id = ?
+"""
+
+DELETE_EVENT = """
+    DELETE FROM eventmodel WHERE id = ? AND bucket_id = ?
+"""
+
+# {index} and {where} are filled in by _where_range
+GET_EVENTS = """
+    SELECT id, timestamp, duration, datastr FROM eventmodel{index}
+    WHERE bucket_id = ?{where} ORDER BY timestamp DESC LIMIT ?
+"""
+
+COUNT_EVENTS = """
+    SELECT COUNT(*) FROM eventmodel{index}
+    WHERE bucket_id = ?{where}
+"""
+
 
 def auto_migrate(path: str) -> None:
-    db = SqliteExtDatabase(path)
+    db = SqliteExtDatabase(path, pragmas=PRAGMAS)
     migrator = SqliteMigrator(db)
 
     # check if bucketmodel has datastr field
-    info = db.execute_sql("PRAGMA table_info(bucketmodel)")
+    info = list(db.execute_sql("PRAGMA table_info(bucketmodel)"))
     has_datastr = any(row[1] == "datastr" for row in info)
 
-    if not has_datastr:
+    if info and not has_datastr:
         datastr_field = CharField(default="{}")
         with db.atomic():
             migrate(migrator.add_column("bucketmodel", "datastr", datastr_field))
 
-    db.close()
-
+    # check if eventmodel has endtime field
+    info = list(db.execute_sql("PRAGMA table_info(eventmodel)"))
+    has_endtime = any(row[1] == "endtime" for row in info)
 
-def chunks(ls, n):
-    """Yield successive n-sized chunks from ls.
-    From: https://stackoverflow.com/a/312464/965332"""
-    for i in range(0, len(ls), n):
-        yield ls[i : i + n]
+    if info and not has_endtime:
+        endtime_field = DateTimeField(null=True)
+        with db.atomic():
+            migrate(migrator.add_column("eventmodel", "endtime", endtime_field))
+            # Computed in Python, so that the stored text is exactly what inserting the event
+            # would have written (datetimes are compared as text in range queries)
+            last_id = 0
+            while True:
+                rows = db.execute_sql(
+                    "SELECT id, timestamp, duration FROM eventmodel WHERE id > ? ORDER BY id LIMIT 10000",
+                    (last_id,),
+                ).fetchall()
+                if not rows:
+                    break
+                db.cursor().executemany(
+                    "UPDATE eventmodel SET endtime = ? WHERE id = ?",
+                    (
+                        (
+                            iso8601.parse_date(timestamp).astimezone(timezone.utc)
+                            + timedelta(seconds=duration),
+                            event_id,
+                        )
+                        for event_id, timestamp, duration in rows
+                    ),
+                )
+                last_id = rows[-1][0]
+
+    # the standalone bucket/timestamp/endtime indexes have been replaced by (bucket, timestamp) and (bucket, endtime)
+    db.execute_sql("DROP INDEX IF EXISTS eventmodel_bucket_id")
+    db.execute_sql("DROP INDEX IF EXISTS eventmodel_timestamp")
+    db.execute_sql("DROP INDEX IF EXISTS eventmodel_endtime")
 
+    db.close()
 
-def dt_plus_duration(dt, duration):
-    # See peewee docs on datemath: https://docs.peewee-orm.com/en/latest/peewee/hacks.html#date-math
-    return peewee.fn.strftime(
-        "%Y-%m-%d %H:%M:%f+00:00",
-        (peewee.fn.julianday(dt) - 2440587.5) * 86400.0 + duration,
-        "unixepoch",
-    )
 
 def calculate_bucket_hash_key(name,user):
     return hashlib.md5((str(name)+str(user)).encode("utf-8")).hexdigest()
@@ -96,7 +219,7 @@ class UserModel(BaseModel):
             "created": iso8601.parse_date(self.created)
             .astimezone(timezone.utc)
             .isoformat(),
-            "data": json.loads(self.data),
+            "data": json_loads(self.data),
         }
 
 class BucketModel(BaseModel):
@@ -121,7 +244,7 @@ class BucketModel(BaseModel):
             "type": self.type,
             "client": self.client,
             "hostname": self.hostname,
-            "data": json.loads(self.datastr) if self.datastr else {},
+            "data": json_loads(self.datastr) if self.datastr else {},
             "user": self.user,
             "hash_key": self.hash_key,
         }
@@ -129,11 +252,22 @@ class BucketModel(BaseModel):
 
 class EventModel(BaseModel):
     id = AutoField()
-    bucket = ForeignKeyField(BucketModel, backref="events", index=True)
-    timestamp = DateTimeField(index=True, default=datetime.now)
-    duration = DecimalField()
+    # Not indexed on its own, the composite indexes below start with bucket and cover lookups by it
+    bucket = ForeignKeyField(BucketModel, backref="events", index=False)
+    timestamp = DateTimeField(default=datetime.now)
+    duration = FloatField()
+    # Stored to allow indexed range queries, always equal to timestamp + duration
+    endtime = DateTimeField()
     datastr = CharField()
 
+    class Meta:
+        indexes = (
+            # Lets queries for a bucket ordered by timestamp walk the index instead of sorting
+            (("bucket", "timestamp"), False),
+            # Lets the starttime bound of range queries skip everything that ended earlier (see _where_range)
+            (("bucket", "endtime"), False),
+        )
+
     @classmethod
     def from_event(cls, bucket_key, event: Event):
         return cls(
@@ -141,15 +275,16 @@ class EventModel(BaseModel):
             id=event.id,
             timestamp=event.timestamp,
             duration=event.duration.total_seconds(),
-            datastr=json.dumps(event.data),
+            endtime=event.timestamp + event.duration,
+            datastr=json_dumps(event.data),
         )
 
     def json(self):
         return {
             "id": self.id,
             "timestamp": self.timestamp,
-            "duration": float(self.duration),
-            "data": json.loads(self.datastr),
+            "duration": self.duration,
+            "data": json_loads(self.datastr),
         }
 
 class PeeweeStorage(AbstractStorage):
@@ -167,30 +302,53 @@ class PeeweeStorage(AbstractStorage):
                 + ".db"
             )
             filepath = os.path.join(data_dir, filename)
+        _db.initialize(SqliteExtDatabase(filepath, pragmas=PRAGMAS))
+        # Go through the proxy (like the models do) so raw SQL and the ORM always share a connection
         self.db = _db
-        self.db.init(filepath)
         logger.info(f"Using database file: {filepath}")
+        # Neither is required, but running without them is slower (see "Optional speedups" in the README)
+        if not CYTHON_SQLITE_EXTENSIONS:
+            logger.info("peewee's C extensions (playhouse._sqlite_ext) are not available")
+        if not ORJSON:
+            logger.info("orjson is not installed, using the json module for event data")
+
+        # Migrate database if needed, has to happen before create_table() tries to index new columns
+        auto_migrate(filepath)
         self.db.connect()
 
         self.bucket_hash_keys: Dict[str, int] = {}
+        # Result of buckets(), reset whenever buckets (or the users they reference) change.
+        # Filling and resetting it happen under the lock, so that a fill which read the buckets before
+        # a concurrent change (aw-server handles requests in threads) can't be stored after the reset.
+        self._buckets_cache: Optional[Dict[str, Dict[str, Any]]] = None
+        self._buckets_cache_lock = Lock()
         BucketModel.create_table(safe=True)
         EventModel.create_table(safe=True)
         UserModel.create_table(safe=True)
 
-        # Migrate database if needed, requires closing the connection first
-        self.db.close()
-        auto_migrate(filepath)
-        self.db.connect()
-
-        # Update bucket keys
+        # Load bucket keys, kept up to date by create_bucket/delete_bucket from here on
         self.update_bucket_hash_keys()
 
     def update_bucket_hash_keys(self) -> None:
-        buckets = BucketModel.select()
-        self.bucket_hash_keys = {bucket.hash_key: bucket.key for bucket in buckets}
+        buckets = BucketModel.select(BucketModel.hash_key, BucketModel.key).tuples()
+        self.bucket_hash_keys = dict(buckets)
 
     def buckets(self) -> Dict[str, Dict[str, Any]]:
-        return {bucket.hash_key: bucket.json() for bucket in BucketModel.select()}
+        with self._buckets_cache_lock:
+            if self._buckets_cache is None:
+                self._buckets_cache = {
+                    bucket.hash_key: bucket.json() for bucket in BucketModel.select()
+                }
+            buckets = self._buckets_cache
+        # Callers are free to modify the returned dicts, so don't hand out the cached ones
+        return {hash_key: dict(bucket) for hash_key, bucket in buckets.items()}
+
+    def _reset_buckets_cache(self) -> None:
+        with self._buckets_cache_lock:
+            self._buckets_cache = None
+
+    def bucket_exists(self, bucket_hash_key: str) -> bool:
+        return bucket_hash_key in self.bucket_hash_keys
 
     def create_bucket(
         self,
@@ -204,19 +362,21 @@ class PeeweeStorage(AbstractStorage):
         user: Optional[int] = None
     ):
         user_id = user
-        BucketModel.create(
+        hash_key = calculate_bucket_hash_key(bucket_id, user_id)
+        bucket = BucketModel.create(
             id=bucket_id,
             type=type_id,
             client=client,
             hostname=hostname,
             created=created,
             name=name,
-            datastr=json.dumps(data or {}),
+            datastr=json_dumps(data or {}),
             user=user_id,
-            hash_key=calculate_bucket_hash_key(bucket_id,user_id)
+            hash_key=hash_key,
         )
-        self.update_bucket_hash_keys()
-        return calculate_bucket_hash_key(bucket_id,user_id)
+        self.bucket_hash_keys[hash_key] = bucket.key
+        self._reset_buckets_cache()
+        return hash_key
 
     def update_bucket(
         self,
@@ -239,21 +399,20 @@ class PeeweeStorage(AbstractStorage):
             if name is not None:
                 bucket.name = name
             if data is not None:
-                bucket.datastr = json.dumps(data)  # Encoding data dictionary to JSON
+                bucket.datastr = json_dumps(data)  # Encoding data dictionary to JSON
 
             bucket.save()
+            self._reset_buckets_cache()
         else:
             raise ValueError("Bucket did not exist, could not update")
 
     def delete_bucket(self, bucket_hash_key: str) -> None:
         if bucket_hash_key in self.bucket_hash_keys:
-            EventModel.delete().where(
-                EventModel.bucket == self.bucket_hash_keys[bucket_hash_key]
-            ).execute()
-            BucketModel.delete().where(
-                BucketModel.key == self.bucket_hash_keys[bucket_hash_key]
-            ).execute()
-            self.update_bucket_hash_keys()
+            bucket_key = self.bucket_hash_keys[bucket_hash_key]
+            EventModel.delete().where(EventModel.bucket == bucket_key).execute()
+            BucketModel.delete().where(BucketModel.key == bucket_key).execute()
+            del self.bucket_hash_keys[bucket_hash_key]
+            self._reset_buckets_cache()
         else:
             raise ValueError("Bucket did not exist, could not delete")
 
@@ -272,76 +431,112 @@ class PeeweeStorage(AbstractStorage):
         event.id = e.id
         return event
 
-    def insert_many(self, bucket_hash_key: str, events: List[Event]) -> None:
+    def insert_many(self, bucket_hash_key: str, events: List[Event]) -> List[Event]:
         # NOTE: Events need to be handled differently depending on
         #       if they're upserts or inserts (have id's or not).
 
-        # These events are updates which need to be applied one by one
-        events_updates = [e for e in events if e.id is not None]
-        for e in events_updates:
-            self.insert_one(bucket_hash_key, e)
-
-        # These events can be inserted with insert_many
-        events_dictlist = [
-            {
-                "bucket": self.bucket_hash_keys[bucket_hash_key],
-                "timestamp": event.timestamp,
-                "duration": event.duration.total_seconds(),
-                "datastr": json.dumps(event.data),
-            }
-            for event in events
-            if event.id is None
-        ]
+        # Everything is done in a single transaction, otherwise every statement is committed separately
+        with self.db.atomic():
+            bucket_key = self.bucket_hash_keys[bucket_hash_key]
+
+            # These events are updates, applied as UPDATE ... CASE statements.
+            # Like insert_one, an upsert moves the event to this bucket if it was stored in another one.
+            events_updates = [
+                EventModel(
+                    id=e.id,
+                    bucket=bucket_key,
+                    timestamp=e.timestamp,
+                    duration=e.duration.total_seconds(),
+                    endtime=e.timestamp + e.duration,
+                    datastr=json_dumps(e.data),
+                )
+                for e in events
+                if e.id is not None
+            ]
+            if events_updates:
+                # The batch size keeps the number of variables (11 per event) below SQLITE_LIMIT_VARIABLE_NUMBER
+                EventModel.bulk_update(
+                    events_updates,
+                    fields=[
+                        EventModel.bucket,
+                        EventModel.timestamp,
+                        EventModel.duration,
+                        EventModel.endtime,
+                        EventModel.datastr,
+                    ],
+                    batch_size=90,
+                )
+
+            # These events are inserted with executemany on the raw cursor, skipping peewee's
+            # per-row model/field conversion. Values are passed the same way peewee would pass them.
+            # Since every row is bound separately, no chunking is needed for SQLITE_LIMIT_VARIABLE_NUMBER.
+            events_inserts = [e for e in events if e.id is None]
+            self.db.cursor().executemany(
+                INSERT_EVENT,
+                (
+                    (
+                        bucket_key,
+                        event.timestamp,
+                        event.duration.total_seconds(),
+                        event.timestamp + event.duration,
+                        json_dumps(event.data),
+                    )
+                    for event in events_inserts
+                ),
+            )
 
-        # Chunking into lists of length 100 is needed here due to SQLITE_MAX_COMPOUND_SELECT
-        # and SQLITE_LIMIT_VARIABLE_NUMBER under Windows.
-        # See: https://github.com/coleifer/peewee/issues/948
-        for chunk in chunks(events_dictlist, 100):
-            EventModel.insert_many(chunk).execute()
+            # Assign ids like insert_one does. Since we hold the write lock for the whole transaction
+            # and the id column is a rowid alias (no AUTOINCREMENT), SQLite gives the inserted rows
+            # consecutive ids ending at last_insert_rowid().
+            if events_inserts:
+                last_id = self.db.execute_sql("SELECT last_insert_rowid()").fetchone()[0]
+                first_id = last_id - len(events_inserts) + 1
+                for i, event in enumerate(events_inserts):
+                    event.id = first_id + i
 
-    def _get_event(self, bucket_hash_key, event_id) -> Optional[EventModel]:
-        try:
-            return (
-                EventModel.select()
-                .where(EventModel.id == event_id)
-                .where(EventModel.bucket == self.bucket_hash_keys[bucket_hash_key])
-                .get()
-            )
-        except peewee.DoesNotExist:
-            return None
+        return events
 
-    def _get_last(self, bucket_hash_key) -> EventModel:
-        return (
-            EventModel.select()
-            .where(EventModel.bucket == self.bucket_hash_keys[bucket_hash_key])
-            .order_by(EventModel.timestamp.desc())
-            .get()
+    def _get_event(self, bucket_hash_key, event_id) -> Optional[tuple]:
+        return self.db.execute_sql(
+            GET_EVENT, (event_id, self.bucket_hash_keys[bucket_hash_key])
+        ).fetchone()
+
+    def _get_last(self, bucket_hash_key) -> Optional[tuple]:
+        return self.db.execute_sql(
+            GET_LAST_EVENT, (self.bucket_hash_keys[bucket_hash_key],)
+        ).fetchone()
+
+    def _update_event(self, bucket_hash_key, event_id, event) -> int:
+        cursor = self.db.execute_sql(
+            UPDATE_EVENT,
+            (
+                event.timestamp,
+                event.duration.total_seconds(),
+                event.timestamp + event.duration,
+                json_dumps(event.data),
+                event_id,
+                self.bucket_hash_keys[bucket_hash_key],
+            ),
         )
+        return cursor.rowcount
 
     def replace_last(self, bucket_hash_key, event):
-        e = self._get_last(bucket_hash_key)
-        e.timestamp = event.timestamp
-        e.duration = event.duration.total_seconds()
-        e.datastr = json.dumps(event.data)
-        e.save()
-        event.id = e.id
+        row = self._get_last(bucket_hash_key)
+        if row is None:
+            raise ValueError("Bucket has no events, could not replace last event")
+        self._update_event(bucket_hash_key, row[0], event)
+        event.id = row[0]
         return event
 
     def delete(self, bucket_hash_key, event_id):
-        return (
-            EventModel.delete()
-            .where(EventModel.id == event_id)
-            .where(EventModel.bucket == self.bucket_hash_keys[bucket_hash_key])
-            .execute()
-        )
+        return self.db.execute_sql(
+            DELETE_EVENT, (event_id, self.bucket_hash_keys[bucket_hash_key])
+        ).rowcount
 
     def replace(self, bucket_hash_key, event_id, event):
-        e = self._get_event(bucket_hash_key, event_id)
-        e.timestamp = event.timestamp
-        e.duration = event.duration.total_seconds()
-        e.datastr = json.dumps(event.data)
-        e.save()
-        event.id = e.id
+        if not self._update_event(bucket_hash_key, event_id, event):
+            raise ValueError("Event did not exist, could not replace")
+        event.id = event_id
         return event
 
     def get_event(
@@ -352,8 +547,10 @@ class PeeweeStorage(AbstractStorage):
         """
         Fetch a single event from a bucket.
         """
-        res = self._get_event(bucket_hash_key, event_id)
-        return Event(**EventModel.json(res)) if res else None
+        row = self._get_event(bucket_hash_key, event_id)
+        if row is None:
+            return None
+        return Event(id=row[0], timestamp=row[1], duration=row[2], data=json_loads(row[3]))
 
     def get_events(
         self,
@@ -379,29 +576,29 @@ class PeeweeStorage(AbstractStorage):
         """
         if limit == 0:
             return []
-        bucket_key = BucketModel.get(BucketModel.hash_key == bucket_hash_key).key
-        q = (
-            EventModel.select()
-            .where(EventModel.bucket == bucket_key)
-            .order_by(EventModel.timestamp.desc())
-            .limit(limit)
-        )
-
-        q = self._where_range(q, starttime, endtime)
-
-        res = q.execute()
-
-        events = [Event(**e) for e in list(map(EventModel.json, res))]
+        if bucket_hash_key not in self.bucket_hash_keys:
+            raise ValueError("Bucket did not exist, could not get events")
+        sql, params = self._where_range(GET_EVENTS, bucket_hash_key, starttime, endtime)
+        params.append(limit)
+
+        # Rows are read as plain tuples, skipping the creation of a model per row
+        events = [
+            Event(id=row[0], timestamp=row[1], duration=row[2], data=json_loads(row[3]))
+            for row in self.db.execute_sql(sql, params)
+        ]
 
         # Trim events that are out of range (as done in aw-server-rust)
         # TODO: Do the same for the other storage methods
-        for e in events:
-            if starttime:
-                if e.timestamp < starttime:
-                    e_end = e.timestamp + e.duration
-                    e.timestamp = starttime
-                    e.duration = e_end - e.timestamp
-            if endtime:
+        if starttime:
+            # Events are sorted by descending timestamp, so the ones starting before starttime are all at the end
+            for e in reversed(events):
+                if e.timestamp >= starttime:
+                    break
+                e_end = e.timestamp + e.duration
+                e.timestamp = starttime
+                e.duration = e_end - e.timestamp
+        if endtime:
+            for e in events:
                 if e.timestamp + e.duration > endtime:
                     e.duration = endtime - e.timestamp
         return events
@@ -412,36 +609,33 @@ class PeeweeStorage(AbstractStorage):
         starttime: Optional[datetime] = None,
         endtime: Optional[datetime] = None,
     ) -> int:
-        q = EventModel.select().where(EventModel.bucket == self.bucket_hash_keys[bucket_hash_key])
-        q = self._where_range(q, starttime, endtime)
-        return q.count()
+        sql, params = self._where_range(COUNT_EVENTS, bucket_hash_key, starttime, endtime)
+        return self.db.execute_sql(sql, params).fetchone()[0]
 
     def _where_range(
         self,
-        q,
+        sql: str,
+        bucket_hash_key: str,
         starttime: Optional[datetime] = None,
         endtime: Optional[datetime] = None,
-    ):
-        # Important to normalize datetimes to UTC, otherwise any UTC offset will be ignored
-        if starttime:
-            starttime = starttime.astimezone(timezone.utc)
-        if endtime:
-            endtime = endtime.astimezone(timezone.utc)
+    ) -> Tuple[str, List[Any]]:
+        index = ""
+        where = ""
+        params: List[Any] = [self.bucket_hash_keys[bucket_hash_key]]
 
+        # Important to normalize datetimes to UTC, otherwise any UTC offset will be ignored
         if starttime:
-            # Faster WHERE to speed up slow query below, leads to ~2-3x speedup
-            # We'll assume events aren't >24h
-            q = q.where(starttime - timedelta(hours=24) <= EventModel.timestamp)
-
-            # This can be slow on large databases...
-            # Tried creating various indexes and using SQLite's unlikely() function, but it had no effect
-            q = q.where(
-                starttime <= dt_plus_duration(EventModel.timestamp, EventModel.duration)
-            )
+            # Seek to the starttime bound in the (bucket, endtime) index. Given the choice, SQLite uses the
+            # (bucket, timestamp) index for the ORDER BY instead, checking endtime on every row back to the
+            # first event of the bucket, since nothing bounds timestamp from below.
+            index = " INDEXED BY eventmodel_bucket_id_endtime"
+            where += " AND endtime >= ?"
+            params.append(starttime.astimezone(timezone.utc))
         if endtime:
-            q = q.where(EventModel.timestamp <= endtime)
+            where += " AND timestamp <= ?"
+            params.append(endtime.astimezone(timezone.utc))
 
-        return q
+        return sql.format(index=index, where=where), params
 
     def get_user_by_uuid(self, user_uuid: int) -> Optional[dict]:
         user = {}
@@ -453,6 +647,7 @@ class PeeweeStorage(AbstractStorage):
         return user
     def update_user(self, user_uuid: int, data):
         UserModel.update(**data).where(UserModel.uuid == user_uuid).execute()
+        self._reset_buckets_cache()
 
     def create_user(self, data):
         UserModel.create(**data)
@@ -461,11 +656,27 @@ class PeeweeStorage(AbstractStorage):
         return [user.json() for user in UserModel.select()]
 
     def get_buckets_for_user(self, user):
+        # Count events and their data size for all buckets in a single GROUP BY instead of one query per bucket
+        stats_q = EventModel.select(
+            EventModel.bucket,
+            peewee.fn.COUNT(EventModel.id),
+            # LENGTH() of text counts characters, as a blob it's the size in bytes
+            peewee.fn.SUM(peewee.fn.LENGTH(EventModel.datastr.cast("BLOB"))),
+        )
+        q = BucketModel.select()
+        if user != "all":
+            stats_q = stats_q.join(BucketModel).where(BucketModel.user == user)
+            q = q.where(BucketModel.user == user)
+        stats = {
+            bucket_key: (count, data_size)
+            for bucket_key, count, data_size in stats_q.group_by(EventModel.bucket).tuples()
+        }
         buckets = {}
-        if user == "all":
-            buckets = {b.hash_key: {**b.json(),'events_count': self.get_eventcount(b.hash_key, starttime=datetime.strptime('2020-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),endtime=datetime.now())} for b in BucketModel.select()}
-        else:
-            buckets = {b.hash_key: {**b.json(),'events_count': self.get_eventcount(b.hash_key, starttime=datetime.strptime('2020-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'),endtime=datetime.now())} for b in BucketModel.select().where(BucketModel.user == user)}
-        for i in buckets:
-            buckets[i]['estimated_size'] = buckets[i]['events_count'] * 150
-        return buckets
\ No newline at end of file
+        for b in q:
+            count, data_size = stats.get(b.key, (0, 0))
+            buckets[b.hash_key] = {
+                **b.json(),
+                "events_count": count,
+                "estimated_size": data_size + count * EVENT_ROW_OVERHEAD,
+            }
+        return buckets
@@ -37,7 +37,7 @@ from .exceptions import QueryFunctionException
 
 
 def _verify_bucket_exists(datastore, bucketname):
-    if bucketname in datastore.buckets():
+    if datastore.bucket_exists(bucketname):
         return
     else:
         raise QueryFunctionException(f"There's no bucket named '{bucketname}'")
@@ -1,5 +1,7 @@
 import logging
+import math
 import random
+import sqlite3
 from datetime import datetime, timedelta, timezone
 
 import iso8601
@@ -89,6 +91,32 @@ def test_delete_bucket(datastore):
         datastore.delete_bucket(bid)
 
 
+@pytest.mark.parametrize("datastore", param_datastore_objects())
+def test_buckets_after_changes(datastore):
+    """
+    Tests that buckets() reflects creating, updating and deleting a bucket
+    """
+    bid = "test-" + str(random.randint(0, 1000000))
+    datastore.buckets()
+    bucket = datastore.create_bucket(
+        bucket_id=bid, type="test", client="test", hostname="test", name="test"
+    )
+    try:
+        buckets = datastore.buckets()
+        assert bucket.bucket_hash_key in buckets
+        assert buckets[bucket.bucket_hash_key]["name"] == "test"
+
+        datastore.update_bucket(bucket.bucket_hash_key, name="new name")
+        assert datastore.buckets()[bucket.bucket_hash_key]["name"] == "new name"
+
+        # Changing the returned dicts must not affect later calls
+        datastore.buckets()[bucket.bucket_hash_key]["name"] = "changed"
+        assert datastore.buckets()[bucket.bucket_hash_key]["name"] == "new name"
+    finally:
+        datastore.delete_bucket(bucket.bucket_hash_key)
+    assert bucket.bucket_hash_key not in datastore.buckets()
+
+
 @pytest.mark.parametrize("datastore", param_datastore_objects())
 def test_nonexistent_bucket(datastore):
     """
@@ -165,6 +193,79 @@ def test_insert_many_upsert(bucket_cm):
             assert e.data["key"] == "new val"
 
 
+@pytest.mark.parametrize("datastore", param_datastore_objects())
+def test_insert_many_upsert_other_bucket(datastore):
+    """
+    Tests that upserting events stored in another bucket moves them, like insert_one does
+    """
+    if not isinstance(datastore.storage_strategy, PeeweeStorage):
+        pytest.skip("Moving events between buckets not supported for datastore")
+
+    suffix = str(random.randint(0, 1000000))
+    bucket_a = datastore.create_bucket(
+        bucket_id="test-a-" + suffix, type="test", client="test", hostname="test"
+    )
+    bucket_b = datastore.create_bucket(
+        bucket_id="test-b-" + suffix, type="test", client="test", hostname="test"
+    )
+    try:
+        bucket_a.insert(2 * [Event(timestamp=now, duration=td1s, data={"key": "val"})])
+        events = bucket_a.get(limit=-1)
+        for e in events:
+            e.data["key"] = "new val"
+
+        # Upsert the events into the other bucket
+        bucket_b.insert(events)
+
+        assert bucket_a.get(limit=-1) == []
+        for e in events:
+            assert bucket_a.get_by_id(e.id) is None
+            assert bucket_b.get_by_id(e.id).data["key"] == "new val"
+        assert len(bucket_b.get(limit=-1)) == 2
+    finally:
+        datastore.delete_bucket(bucket_a.bucket_hash_key)
+        datastore.delete_bucket(bucket_b.bucket_hash_key)
+
+
+@pytest.mark.parametrize("datastore", param_datastore_objects())
+def test_insert_many_ids(datastore):
+    """
+    Tests that events inserted in bulk get the ids they were stored with
+    """
+    if not isinstance(datastore.storage_strategy, PeeweeStorage):
+        pytest.skip("Assigning ids on bulk inserts not supported for datastore")
+
+    num_events = 10
+    bid = "test-" + str(random.randint(0, 1000000))
+    bucket = datastore.create_bucket(
+        bucket_id=bid, type="test", client="test", hostname="test"
+    )
+    try:
+        # An event inserted on its own first, so ids don't simply start at 1
+        bucket.insert(Event(timestamp=now, duration=td1s, data={"i": -1}))
+        events = [
+            Event(timestamp=now + i * td1s, duration=td1s, data={"i": i})
+            for i in range(num_events)
+        ]
+        bucket.insert(events)
+
+        assert num_events == len({e.id for e in events})
+        for e in events:
+            assert e == bucket.get_by_id(e.id)
+
+        # Upserts keep their ids, new events in the same batch get fresh ones
+        events[0].data = {"i": "updated"}
+        mixed = [events[0], Event(timestamp=now, duration=td1s, data={"i": "new"})]
+        bucket.insert(mixed)
+        assert mixed[1].id is not None
+        assert mixed[1].id not in {e.id for e in events}
+        for e in mixed:
+            assert e == bucket.get_by_id(e.id)
+        assert num_events + 2 == bucket.get_eventcount()
+    finally:
+        datastore.delete_bucket(bucket.bucket_hash_key)
+
+
 @pytest.mark.parametrize("bucket_cm", param_testing_buckets_cm())
 def test_delete(bucket_cm):
     """
@@ -203,6 +304,35 @@ def test_insert_badtype(bucket_cm):
         assert bucket_len == len(bucket.get())
 
 
+@pytest.mark.parametrize("datastore", param_datastore_objects())
+def test_insert_data_json(datastore):
+    """
+    Tests that event data is stored like the json module would store it
+    """
+    bid = "test-" + str(random.randint(0, 1000000))
+    bucket = datastore.create_bucket(
+        bucket_id=bid, type="test", client="test", hostname="test"
+    )
+    try:
+        data = {"big": 2**64, "nested": {"list": [1, 2.5, None, "ö"]}}
+        bucket.insert([Event(timestamp=now, data=data), Event(timestamp=now, data=data)])
+        for e in bucket.get(limit=-1):
+            assert e.data == data
+
+        # Not valid JSON, but json.dumps keeps them instead of turning them into null
+        bucket.insert(
+            Event(timestamp=now + td1s, data={"nan": float("nan"), "inf": [float("inf"), -float("inf")]})
+        )
+        data = bucket.get(limit=1)[0].data
+        assert math.isnan(data["nan"])
+        assert data["inf"] == [float("inf"), -float("inf")]
+
+        with pytest.raises(TypeError):
+            bucket.insert(Event(timestamp=now, data={"timestamp": now}))
+    finally:
+        datastore.delete_bucket(bucket.bucket_hash_key)
+
+
 @pytest.mark.parametrize("bucket_cm", param_testing_buckets_cm())
 def test_get_ordered(bucket_cm):
     """
@@ -584,3 +714,97 @@ def test_get_eventcount(bucket_cm):
         )
         assert bucket.get_eventcount(endtime=now + timedelta(seconds=1)) == 5
         assert bucket.get_eventcount(starttime=now + timedelta(seconds=1)) == 1
+
+
+@pytest.mark.parametrize("datastore", param_datastore_objects())
+def test_peewee_range_query_plan(datastore):
+    """
+    Tests that range queries with a starttime seek on the (bucket, endtime) index instead of
+    walking the bucket's events by timestamp
+    """
+    if not isinstance(datastore.storage_strategy, PeeweeStorage):
+        pytest.skip("Query plans only apply to PeeweeStorage")
+    from aw_datastore.storages.peewee import COUNT_EVENTS, GET_EVENTS
+
+    storage = datastore.storage_strategy
+    bid = "test-" + str(random.randint(0, 1000000))
+    bucket = datastore.create_bucket(
+        bucket_id=bid, type="test", client="test", hostname="test"
+    )
+    try:
+        for sql in [GET_EVENTS, COUNT_EVENTS]:
+            for endtime in [now, None]:
+                query, params = storage._where_range(
+                    sql, bucket.bucket_hash_key, now - td1d, endtime
+                )
+                if sql == GET_EVENTS:
+                    params.append(-1)
+                plan = " ".join(
+                    row[3]
+                    for row in storage.db.execute_sql("EXPLAIN QUERY PLAN " + query, params)
+                )
+                assert "eventmodel_bucket_id_endtime (bucket_id=? AND endtime>?)" in plan
+    finally:
+        datastore.delete_bucket(bucket.bucket_hash_key)
+
+
+def test_peewee_migrate_endtime(tmp_path):
+    """
+    Tests that events stored before the endtime column existed get the same endtime a new insert would get
+    """
+    from aw_datastore.storages.peewee import _db, calculate_bucket_hash_key
+
+    path = str(tmp_path / "peewee-sqlite-old.db")
+    start = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+    events = [
+        Event(timestamp=start + i * timedelta(minutes=1), duration=duration)
+        for i, duration in enumerate([1, 30.5, 0.001, 59.999, 0])
+    ]
+
+    # Schema as created before endtime was added
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE "bucketmodel" ("key" INTEGER NOT NULL PRIMARY KEY, "id" VARCHAR(255) NOT NULL, "created" DATETIME NOT NULL, "name" VARCHAR(255), "type" VARCHAR(255) NOT NULL, "client" VARCHAR(255) NOT NULL, "hostname" VARCHAR(255) NOT NULL, "datastr" VARCHAR(255), "user_id" INTEGER, "hash_key" VARCHAR(255) NOT NULL);
+        CREATE TABLE "eventmodel" ("id" INTEGER NOT NULL PRIMARY KEY, "bucket_id" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, "duration" DECIMAL(10, 5) NOT NULL, "datastr" VARCHAR(255) NOT NULL);
+        CREATE INDEX "eventmodel_bucket_id" ON "eventmodel" ("bucket_id");
+        CREATE INDEX "eventmodel_timestamp" ON "eventmodel" ("timestamp");
+        """
+    )
+    conn.execute(
+        "INSERT INTO bucketmodel VALUES (1, 'old', ?, NULL, 'testtype', 'testclient', 'testhost', '{}', NULL, ?)",
+        (str(start), calculate_bucket_hash_key("old", None)),
+    )
+    conn.executemany(
+        "INSERT INTO eventmodel (bucket_id, timestamp, duration, datastr) VALUES (1, ?, ?, '{}')",
+        [(str(e.timestamp), e.duration.total_seconds()) for e in events],
+    )
+    conn.commit()
+    conn.close()
+
+    prev_db = _db.obj
+    try:
+        storage = PeeweeStorage(filepath=path)
+        old = calculate_bucket_hash_key("old", None)
+        new = storage.create_bucket("new", "testtype", "testclient", "testhost", str(start))
+        storage.insert_many(new, [Event(timestamp=e.timestamp, duration=e.duration) for e in events])
+
+        endtimes = storage.db.execute_sql(
+            "SELECT bucket_id, endtime FROM eventmodel ORDER BY bucket_id, id"
+        ).fetchall()
+        assert [t for b, t in endtimes if b == 1] == [t for b, t in endtimes if b != 1]
+
+        for starttime, endtime in [
+            (start + timedelta(seconds=1), start + timedelta(minutes=2)),
+            (start + timedelta(minutes=1, seconds=30.5), start + timedelta(minutes=3, seconds=59.999)),
+            (start + timedelta(minutes=4), None),
+        ]:
+            expected = storage.get_events(new, -1, starttime, endtime)
+            migrated = storage.get_events(old, -1, starttime, endtime)
+            assert [(e.timestamp, e.duration) for e in migrated] == [
+                (e.timestamp, e.duration) for e in expected
+            ]
+            assert storage.get_eventcount(old, starttime, endtime) == len(expected)
+    finally:
+        _db.obj.close()
+        _db.initialize(prev_db)
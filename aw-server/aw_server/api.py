@@ -42,7 +42,7 @@ def get_device_id() -> str:
 def check_bucket_exists(f):
     @functools.wraps(f)
     def g(self, bucket_hash_key, *args, **kwargs):
-        if bucket_hash_key not in self.db.buckets():
+        if not self.db.bucket_exists(bucket_hash_key):
             raise NotFound("NoSuchBucket", f"There's no bucket with hash key {bucket_hash_key}")
         return f(self, bucket_hash_key, *args, **kwargs)
 
@@ -54,7 +54,7 @@ def check_bucket_exists_over_hash(self,bucket_id, uuid):
         raise NotFound("NoSuchUser", f"There's no user with uuid {uuid}")
     user_id = user_id["user"]["id"]
     bucket_hash_key = hashlib.md5((str(bucket_id) + str(user_id)).encode("utf-8")).hexdigest()
-    if bucket_hash_key not in self.db.buckets():
+    if not self.db.bucket_exists(bucket_hash_key):
         raise NotFound("NoSuchBucket", f"There's no bucket with hash key {bucket_hash_key}")
     return True
 class ServerAPI:
@@ -170,12 +170,12 @@ class ServerAPI:
             return False
         user_id = user_id["user"]["id"]
         bucket_hash_key = hashlib.md5((str(bucket_id)+str(user_id)).encode("utf-8")).hexdigest()
-        if bucket_hash_key in self.db.buckets():
+        if self.db.bucket_exists(bucket_hash_key):
             return False
 
         if created is None:
             created = datetime.now()
-        if bucket_id in self.db.buckets():
+        if self.db.bucket_exists(bucket_id):
             return False
         if hostname == "!local":
             info = self.get_info()